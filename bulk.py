@@ -0,0 +1,208 @@
+import hashlib
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing import Event, Pool
+
+from config import (BULK_PARALLEL_TASKS, BULK_YIELD_INTERVAL, DEBUG,
+                    PARALLEL_TESTS, TEST_CASE_DIR)
+from exceptions import JudgeServiceError
+from judger import Judger, MakeJudgeDir, _init_worker
+from languages import CONFIG, JudgeResult
+
+
+class TaggedQueue(object):
+
+    def __init__(self, queue, task_id):
+        self.queue = queue
+        self.task_id = task_id
+
+    def put(self, item):
+        self.queue.put(dict(item, task_id=self.task_id))
+
+
+class BulkJudger(object):
+    """
+        Judge a batch of tasks in the same format as single tasks. Tasks of
+        the same problem share staged test data and checker, identical
+        sources are compiled once and up to BULK_PARALLEL_TASKS tasks run
+        their cases in one shared pool. Every case of a bulk task is run,
+        fail_fast is rejected. While busy() is true no new case starts.
+    """
+
+    def __init__(self, tasks, result_queue, busy=None):
+        if not isinstance(tasks, list) \
+                or not all(isinstance(i, dict) for i in tasks):
+            raise JudgeServiceError('Bulk tasks must be a list of tasks')
+        self.tasks = tasks
+        self.result_queue = result_queue
+        self.busy = busy
+        self.compiled = {}
+        self.batch_dir = None
+        self.pool = None
+        # Tasks whose final report has been sent
+        self.reported = set()
+        # Started tasks waiting for their cases, in submission order
+        self.pending = deque()
+        # Cleared while the node is busy, pool workers wait on it
+        self.idle_event = Event()
+        self.idle_event.set()
+        self.done = threading.Event()
+
+    def judge(self):
+        groups = {}
+        for task in self.tasks:
+            groups.setdefault((task.get('case_id'), task.get('spj_id')),
+                              []).append(task)
+        try:
+            with MakeJudgeDir(f'bulk-{uuid.uuid4()}',
+                              debug=DEBUG) as self.batch_dir:
+                self.pool = Pool(processes=PARALLEL_TESTS,
+                                 initializer=_init_worker,
+                                 initargs=(None, self.idle_event))
+                watcher = threading.Thread(target=self.watch, daemon=True)
+                watcher.start()
+                try:
+                    for index, ((case_id, spj_id),
+                                tasks) in enumerate(groups.items()):
+                        self.judge_group(self.batch_dir / f'group-{index}',
+                                         case_id, spj_id, tasks)
+                finally:
+                    # Also on errors, so started tasks are reported and
+                    # their dirs removed
+                    while self.pending:
+                        self.finish_task(*self.pending.popleft())
+                    self.pool.close()
+                    self.pool.join()
+                    self.done.set()
+                    self.idle_event.set()
+                    watcher.join()
+        except Exception as e:
+            # Only batch errors get here, tasks judged so far have been
+            # reported already and the rest are failed.
+            for task in self.tasks:
+                if task.get('task_id') not in self.reported:
+                    self.fail(task, e)
+
+    def report(self, task, item):
+        if item['type'] == 'final':
+            self.reported.add(task.get('task_id'))
+        TaggedQueue(self.result_queue, task.get('task_id')).put(item)
+
+    def fail(self, task, error):
+        # Any error only fails its own task, the batch goes on
+        if not isinstance(error, JudgeServiceError):
+            error = JudgeServiceError(repr(error))
+        self.report(
+            task,
+            Judger.make_report(status=JudgeResult.SYSTEM_ERROR,
+                               score=0,
+                               max_time=0,
+                               max_memory=0,
+                               log=str(error),
+                               detail=[]))
+
+    def judge_group(self, group_dir, case_id, spj_id, tasks):
+        spj_report = None
+        try:
+            test_case = TEST_CASE_DIR / case_id
+            if not test_case.exists():
+                raise JudgeServiceError('Test data not found!')
+            group_dir.mkdir()
+            shutil.copytree(test_case, group_dir / 'data')
+            if spj_id:
+                spj_report = Judger.prepare_spj(spj_id, group_dir)
+        except Exception as e:
+            if not isinstance(e, JudgeServiceError):
+                e = JudgeServiceError(f'Failed to stage test data: {e!r}')
+            for task in tasks:
+                self.fail(task, e)
+            return
+        for task in tasks:
+            self.wait()
+            try:
+                self.start_task(task, group_dir, spj_report)
+            except Exception as e:
+                self.fail(task, e)
+            while len(self.pending) >= BULK_PARALLEL_TASKS:
+                self.finish_task(*self.pending.popleft())
+
+    def start_task(self, task, group_dir, spj_report):
+        if task.get('fail_fast'):
+            raise JudgeServiceError(
+                'fail_fast is not supported in bulk judge')
+        result_queue = TaggedQueue(self.result_queue, task['task_id'])
+        judger = Judger(task_id=task['task_id'],
+                        case_id=task['case_id'],
+                        spj_id=task['spj_id'],
+                        test_case_config=task['test_case_config'],
+                        subcheck_config=task['subcheck_config'],
+                        result_queue=result_queue,
+                        pool=self.pool,
+                        test_case_dir=group_dir / 'data')
+        config = CONFIG.get(task['lang'])
+        if config is None:
+            raise JudgeServiceError('Language not supported!')
+        limit_config = task['limit']
+        compile_dir, compile_log, report = self.compile(
+            task['code'], task['lang'], config)
+        if report is not None:
+            self.report(task, report)
+            return
+        self.report(task, {
+            'type': 'compile',
+            'data': str(compile_log),
+        })
+        if spj_report is not None:
+            self.report(task, spj_report)
+            return
+        judge_dir = MakeJudgeDir(task['task_id'], debug=DEBUG)
+        working_dir = judge_dir.__enter__()
+        try:
+            exe_name = config['compile']['exe_name']
+            shutil.copy(compile_dir / exe_name, working_dir / exe_name)
+            if task['spj_id']:
+                shutil.copy(group_dir / 'checker', working_dir / 'checker')
+                (working_dir / '.spj.in').write_text('', encoding='utf-8')
+            jobs = judger.submit_cases(working_dir, config, limit_config)
+        except BaseException:
+            judge_dir.__exit__(None, None, None)
+            raise
+        self.pending.append((task, judger, judge_dir, jobs, compile_log))
+
+    def finish_task(self, task, judger, judge_dir, jobs, compile_log):
+        try:
+            judger.collect_cases(jobs, compile_log)
+            self.reported.add(task['task_id'])
+        except Exception as e:
+            self.fail(task, e)
+        try:
+            judge_dir.__exit__(None, None, None)
+        except JudgeServiceError:
+            # The task is reported already, leave the dir behind
+            pass
+
+    def compile(self, source_code, lang, config):
+        key = hashlib.sha256(f'{lang}\0{source_code}'.encode('utf-8')) \
+            .hexdigest()
+        if key not in self.compiled:
+            compile_dir = self.batch_dir / key
+            compile_dir.mkdir(exist_ok=True)
+            self.compiled[key] = (compile_dir, ) + Judger.compile_source(
+                compile_dir, source_code, config['compile'])
+        return self.compiled[key]
+
+    def wait(self):
+        # Interactive submissions go first when the node is busy
+        while self.busy is not None and self.busy():
+            time.sleep(BULK_YIELD_INTERVAL)
+
+    def watch(self):
+        # Pause the cases queued in the pool while the node is busy
+        while not self.done.wait(BULK_YIELD_INTERVAL):
+            if self.busy is not None and self.busy():
+                self.idle_event.clear()
+            else:
+                self.idle_event.set()
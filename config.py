@@ -4,9 +4,17 @@ import grp
 
 PARALLEL_TESTS = 2
 PARALLEL_USERS = 1
+# Seconds a bulk judge waits while PARALLEL_USERS interactive tasks run
+BULK_YIELD_INTERVAL = 0.5
+# Bulk tasks whose cases are queued in the pool at the same time
+BULK_PARALLEL_TASKS = 4
 
 BASE_DIR = Path('/judger').resolve()
 
+# Per problem case statistics used to schedule test cases
+CASE_HISTORY_DIR = BASE_DIR / '.history'
+CASE_HISTORY_WINDOW = 50
+
 DEBUG = True
 
 RUN_USER_UID = pwd.getpwnam('code').pw_uid
@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+from config import CASE_HISTORY_DIR, CASE_HISTORY_WINDOW
+from languages import JudgeResult
+
+_lock = threading.Lock()
+
+
+class CaseHistory(object):
+    """
+        Statistics of past judgements for one problem, stored as:
+        {
+            'case name': [runs, avg_cpu_time, failures]
+        }
+    """
+
+    def __init__(self, case_id):
+        self.path = CASE_HISTORY_DIR / f'{case_id}.json'
+        self.stats = self.load()
+
+    def load(self):
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def order(self, test_case_config, fail_fast=False):
+        """
+            Return indexes of test_case_config in scheduling order.
+            Cases never seen before are scheduled first.
+        """
+
+        def key(index):
+            stat = self.stats.get(test_case_config[index]['name'])
+            if stat is None:
+                return (0, 0, 0)
+            runs, avg_time, failures = stat
+            if fail_fast:
+                return (1, -failures / runs, avg_time)
+            return (1, -avg_time, 0)
+
+        return sorted(range(len(test_case_config)), key=key)
+
+    def update(self, results):
+        """
+            Merge results of one judgement, results are dicts returned by
+            Judger.judge_single.
+        """
+        with _lock:
+            stats = self.load()
+            for result in results:
+                runs, avg_time, failures = stats.get(result['test_case'],
+                                                     (0, 0, 0))
+                # Capped counters keep the averages following recent data
+                if runs >= CASE_HISTORY_WINDOW:
+                    failures = failures * (runs - 1) / runs
+                    runs -= 1
+                cpu_time = result['statistic']['cpu_time']
+                avg_time = (avg_time * runs + cpu_time) / (runs + 1)
+                if result['status'] != JudgeResult.ACCEPTED:
+                    failures += 1
+                stats[result['test_case']] = [
+                    runs + 1, round(avg_time, 2), round(failures, 2)
+                ]
+            try:
+                CASE_HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+                tmp_path.write_text(json.dumps(stats, separators=(',', ':')),
+                                    encoding='utf-8')
+                os.replace(tmp_path, self.path)
+            except OSError:
+                return
+            self.stats = stats
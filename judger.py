@@ -2,13 +2,14 @@ import base64
 import hashlib
 import os
 import shutil
-from multiprocessing import Pool
+from multiprocessing import Event, Pool
 from pathlib import Path
 
 import judgercore
 from compiler import Compiler
 from config import BASE_DIR, DEBUG, PARALLEL_TESTS, TEST_CASE_DIR, SPJ_DIR
 from exceptions import JudgeServiceError
+from history import CaseHistory
 from languages import CONFIG, JudgeResult
 from runner import Runner
 
@@ -36,7 +37,23 @@ class MakeJudgeDir(object):
             raise JudgeServiceError('Failed to clean runtime dir')
 
 
+_abort_event = None
+_idle_event = None
+
+
+def _init_worker(abort_event, idle_event=None):
+    global _abort_event, _idle_event
+    _abort_event = abort_event
+    _idle_event = idle_event
+
+
 def _run(instance, *args, **kwargs):
+    # Bulk judge cases hold on while interactive tasks run
+    if _idle_event is not None:
+        _idle_event.wait()
+    # Skip the remaining cases once a case failed in fail fast mode
+    if _abort_event is not None and _abort_event.is_set():
+        return None
     return instance.judge_single(*args, **kwargs)
 
 
@@ -48,10 +65,18 @@ class Judger(object):
         ]
     """
 
-    def __init__(self, task_id, case_id, spj_id, test_case_config,
-                 subcheck_config, result_queue):
+    def __init__(self,
+                 task_id,
+                 case_id,
+                 spj_id,
+                 test_case_config,
+                 subcheck_config,
+                 result_queue,
+                 fail_fast=False,
+                 pool=None,
+                 test_case_dir=None):
         self.task_id = task_id
-        self.test_case = TEST_CASE_DIR / case_id
+        self.test_case = test_case_dir or TEST_CASE_DIR / case_id
         if not self.test_case.exists():
             raise JudgeServiceError('Test data not found!')
         self.spj_id = spj_id
@@ -59,139 +84,195 @@ class Judger(object):
             self.spj_dir = SPJ_DIR / spj_id
         self.test_case_config = test_case_config
         self.subcheck_config = subcheck_config
-        self.pool = Pool(processes=PARALLEL_TESTS)
+        self.history = CaseHistory(case_id)
+        self.fail_fast = fail_fast
+        self.abort_event = Event()
+        # A shared pool is owned by the caller and can't skip cases
+        self.own_pool = pool is None
+        if self.own_pool:
+            pool = Pool(processes=PARALLEL_TESTS,
+                        initializer=_init_worker,
+                        initargs=(self.abort_event, ))
+        self.pool = pool
         self.result_queue = result_queue
 
     def judge(self, source_code, lang, limit_config):
         config = CONFIG.get(lang)
         if config is None:
             raise JudgeServiceError('Language not supported!')
-        compile_config = config['compile']
         with MakeJudgeDir(self.task_id, debug=DEBUG) as working_dir:
-            # Compile user code
-            Path(working_dir / compile_config['src_name']) \
-                .write_text(source_code, encoding='utf-8')
-            compile_result, compile_log = Compiler.compile(
-                working_dir, compile_config)
-            if compile_result['result'] != judgercore.RESULT_SUCCESS \
-                    and not Path(working_dir / compile_config['exe_name']).exists():
-                # TODO: Find out why flag 3 is returned.
-                self.result_queue.put(
-                    self.make_report(
-                        status=JudgeResult.COMPILE_ERROR,
-                        score=0,
-                        max_time=compile_result['real_time'],
-                        max_memory=compile_result['memory'],
-                        log=compile_log,
-                        detail=[],
-                    ))
+            compile_log, report = self.compile_source(working_dir,
+                                                      source_code,
+                                                      config['compile'])
+            if report is not None:
+                self.result_queue.put(report)
                 return
             self.result_queue.put({
                 'type': 'compile',
                 'data': str(compile_log),
             })
-            # Compile SPJ
             if self.spj_id:
-                checker = SPJ_DIR / self.spj_id / 'checker.cpp'
-                if not checker.exists():
-                    self.result_queue.put(
-                        self.make_report(
-                            status=JudgeResult.COMPILE_ERROR,
-                            score=0,
-                            max_time=0,
-                            max_memory=0,
-                            log='SPJ source not found',
-                            detail=[],
-                        ))
+                report = self.prepare_spj(self.spj_id, working_dir)
+                if report is not None:
+                    self.result_queue.put(report)
                     return
-                checker_exe = SPJ_DIR / self.spj_id / 'checker'
-                if checker_exe.exists():
-                    shutil.copyfile(checker_exe, working_dir / 'checker')
-                else:
-                    shutil.copyfile(checker, working_dir / 'checker.cpp')
-                    shutil.copyfile(SPJ_DIR / 'testlib.h',
-                                    working_dir / 'testlib.h')
-                    spj_compile_config = CONFIG.get('spj')['compile']
-                    spj_compile_result, spj_compile_log = Compiler.compile(
-                        working_dir, spj_compile_config)
-                    if spj_compile_result['result'] != judgercore.RESULT_SUCCESS \
-                            and not Path(self.spj_dir / spj_compile_config['exe_name']).exists():
-                        self.result_queue.put(
-                            self.make_report(
-                                status=JudgeResult.COMPILE_ERROR,
-                                score=0,
-                                max_time=spj_compile_result['real_time'],
-                                max_memory=spj_compile_result['memory'],
-                                log=
-                                f'SPJ compile error, info:\n{spj_compile_log}',
-                                detail=[],
-                            ))
-                        return
-                    shutil.copyfile(
-                        working_dir / spj_compile_config['exe_name'],
-                        checker_exe)
-                (working_dir / '.spj.in').write_text('', encoding='utf-8')
-            jobs = []
-            for case in self.test_case_config:
-                result = self.pool.apply_async(
-                    _run,
-                    (
-                        self,
-                        working_dir,
-                        case['name'],
-                        config,
-                        limit_config,
-                    ),
-                    callback=self.real_time_status,
+            self.run_cases(working_dir, config, limit_config, compile_log)
+
+    @classmethod
+    def compile_source(cls, working_dir, source_code, compile_config):
+        """
+            Compile user code in working_dir, return the compile log and a
+            compile error report, which is None on success.
+        """
+        Path(working_dir / compile_config['src_name']) \
+            .write_text(source_code, encoding='utf-8')
+        compile_result, compile_log = Compiler.compile(
+            working_dir, compile_config)
+        if compile_result['result'] != judgercore.RESULT_SUCCESS \
+                and not Path(working_dir / compile_config['exe_name']).exists():
+            # TODO: Find out why flag 3 is returned.
+            return compile_log, cls.make_report(
+                status=JudgeResult.COMPILE_ERROR,
+                score=0,
+                max_time=compile_result['real_time'],
+                max_memory=compile_result['memory'],
+                log=compile_log,
+                detail=[],
+            )
+        return compile_log, None
+
+    @classmethod
+    def prepare_spj(cls, spj_id, working_dir):
+        """
+            Put the compiled checker into working_dir, return a compile error
+            report on failure.
+        """
+        checker = SPJ_DIR / spj_id / 'checker.cpp'
+        if not checker.exists():
+            return cls.make_report(
+                status=JudgeResult.COMPILE_ERROR,
+                score=0,
+                max_time=0,
+                max_memory=0,
+                log='SPJ source not found',
+                detail=[],
+            )
+        checker_exe = SPJ_DIR / spj_id / 'checker'
+        if checker_exe.exists():
+            shutil.copy(checker_exe, working_dir / 'checker')
+        else:
+            shutil.copyfile(checker, working_dir / 'checker.cpp')
+            shutil.copyfile(SPJ_DIR / 'testlib.h', working_dir / 'testlib.h')
+            spj_compile_config = CONFIG.get('spj')['compile']
+            spj_compile_result, spj_compile_log = Compiler.compile(
+                working_dir, spj_compile_config)
+            if spj_compile_result['result'] != judgercore.RESULT_SUCCESS \
+                    and not Path(SPJ_DIR / spj_id / spj_compile_config['exe_name']).exists():
+                return cls.make_report(
+                    status=JudgeResult.COMPILE_ERROR,
+                    score=0,
+                    max_time=spj_compile_result['real_time'],
+                    max_memory=spj_compile_result['memory'],
+                    log=f'SPJ compile error, info:\n{spj_compile_log}',
+                    detail=[],
                 )
-                jobs.append((result, case['score'], case.get('subcheck')))
+            shutil.copy(working_dir / spj_compile_config['exe_name'],
+                        checker_exe)
+        (working_dir / '.spj.in').write_text('', encoding='utf-8')
+        return None
+
+    def run_cases(self, working_dir, config, limit_config, compile_log):
+        jobs = self.submit_cases(working_dir, config, limit_config)
+        if self.own_pool:
             self.pool.close()
             self.pool.join()
-            error_status = []
-            score = 0
-            detail = []
-            max_time = 0
-            max_memory = 0
-            subchecks = self.subcheck_config
-            for job in jobs:
-                result = job[0].get()
-                subcheck = job[2]
-                if result['status'] == JudgeResult.ACCEPTED:
-                    if not subchecks:
-                        score += job[1]
-                else:
-                    if subchecks:
-                        subchecks[subcheck]['score'] = 0
-                    error_status.append(result['status'])
-                time = result['statistic']['cpu_time']
-                memory = result['statistic']['memory']
-                detail.append({
-                    'case_name': result['test_case'],
-                    'status': result['status'],
-                    'statistics': {
-                        'time': time,
-                        'memory': memory,
-                        'exit_code': result['statistic']['exit_code']
-                    },
-                    'subcheck': subcheck,
-                })
-                max_time = max(max_time, time)
-                max_memory = max(max_memory, memory)
-            if len(error_status) == 0:
-                status = JudgeResult.ACCEPTED
+        self.collect_cases(jobs, compile_log)
+
+    def submit_cases(self, working_dir, config, limit_config):
+        # Slow cases start first to shorten the total time, or likely
+        # failing cases in fail fast mode. Results keep the config order.
+        jobs = [None] * len(self.test_case_config)
+        for index in self.history.order(self.test_case_config,
+                                        self.fail_fast):
+            case = self.test_case_config[index]
+            result = self.pool.apply_async(
+                _run,
+                (
+                    self,
+                    working_dir,
+                    case['name'],
+                    config,
+                    limit_config,
+                ),
+                callback=self.real_time_status,
+            )
+            jobs[index] = (result, case['score'], case.get('subcheck'),
+                           case['name'])
+        return jobs
+
+    def collect_cases(self, jobs, compile_log):
+        results = []
+        error_status = []
+        score = 0
+        detail = []
+        max_time = 0
+        max_memory = 0
+        subchecks = self.subcheck_config
+        for job in jobs:
+            result = job[0].get()
+            if result is None:
+                # Skipped in fail fast mode, it scores nothing but doesn't
+                # change the final status
+                result = {
+                    'test_case': job[3],
+                    'status': JudgeResult.SKIPPED,
+                    'statistic': {
+                        'cpu_time': 0,
+                        'memory': 0,
+                        'exit_code': 0
+                    }
+                }
             else:
-                status = max(error_status)
-            if subchecks:
-                score = sum(i['score'] for i in subchecks)
-            self.result_queue.put(
-                self.make_report(
-                    status=status,
-                    score=score,
-                    max_time=max_time,
-                    max_memory=max_memory,
-                    log=compile_log,
-                    detail=detail,
-                ))
+                results.append(result)
+            subcheck = job[2]
+            if result['status'] == JudgeResult.ACCEPTED:
+                if not subchecks:
+                    score += job[1]
+            else:
+                if subchecks:
+                    subchecks[subcheck]['score'] = 0
+                if result['status'] != JudgeResult.SKIPPED:
+                    error_status.append(result['status'])
+            time = result['statistic']['cpu_time']
+            memory = result['statistic']['memory']
+            detail.append({
+                'case_name': result['test_case'],
+                'status': result['status'],
+                'statistics': {
+                    'time': time,
+                    'memory': memory,
+                    'exit_code': result['statistic']['exit_code']
+                },
+                'subcheck': subcheck,
+            })
+            max_time = max(max_time, time)
+            max_memory = max(max_memory, memory)
+        if len(error_status) == 0:
+            status = JudgeResult.ACCEPTED
+        else:
+            status = max(error_status)
+        if subchecks:
+            score = sum(i['score'] for i in subchecks)
+        self.history.update(results)
+        self.result_queue.put(
+            self.make_report(
+                status=status,
+                score=score,
+                max_time=max_time,
+                max_memory=max_memory,
+                log=compile_log,
+                detail=detail,
+            ))
 
     def judge_single(self, working_dir, case_name, config, limit_config):
         in_file = self.test_case / f'{case_name}.in'
@@ -318,6 +399,10 @@ class Judger(object):
         }
 
     def real_time_status(self, detail):
+        if detail is None:
+            return
+        if self.fail_fast and detail['status'] != JudgeResult.ACCEPTED:
+            self.abort_event.set()
         self.result_queue.put({
             'type': 'part',
             'test_case': detail['test_case'],
@@ -328,4 +413,5 @@ class Judger(object):
     def __getstate__(self):
         self_dict = self.__dict__.copy()
         del self_dict['pool']
+        del self_dict['abort_event']
         return self_dict
@@ -11,6 +11,7 @@ class JudgeResult(enum.IntEnum):
     MEMORY_LIMIT_EXCEEDED = 2
     RUNTIME_ERROR = 3
     SYSTEM_ERROR = 4
+    SKIPPED = 5
 
 
 CONFIG = {
@@ -0,0 +1,313 @@
+"""
+    Replay a JSONL trace of task messages against server.py and report
+    latency percentiles and throughput.
+
+    python3 loadtest.py trace.jsonl --rate 5 --concurrency 4 --count 200
+    python3 loadtest.py trace.jsonl --stub    # no sandbox needed
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import signal
+import socket
+import sys
+import time
+import types
+from multiprocessing import Process
+
+import websockets
+
+from languages import JudgeResult
+
+METRICS = ('queue', 'compile', 'first_part', 'final')
+
+
+def load_trace(path):
+    with open(path, encoding='utf-8') as f:
+        trace = [json.loads(line) for line in f if line.strip()]
+    if not trace:
+        raise SystemExit(f'No task found in {path}')
+    # A bulk message has one final per task, records assume one per message
+    if any(i.get('type') == 'bulk' for i in trace):
+        raise SystemExit(f'Bulk messages in {path} are not supported')
+    return trace
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return None
+    # Nearest rank
+    rank = max(0, math.ceil(percent / 100 * len(values)) - 1)
+    return values[rank]
+
+
+class StubJudger(object):
+    """
+        Stand-in for judger.Judger, which needs judgercore and the judge users.
+    """
+
+    @staticmethod
+    def make_report(status, score, max_time, max_memory, log, detail):
+        return {
+            'type': 'final',
+            'status': int(status),
+            'score': int(score),
+            'statistics': {
+                'max_time': int(max_time),
+                'max_memory': int(max_memory)
+            },
+            'log': str(log),
+            'detail': list(detail)
+        }
+
+
+def stub_judge(task, result_queue, compile_time, case_time):
+    """
+        Stand-in for server.judge which emits the same messages without
+        touching the sandbox.
+    """
+    time.sleep(compile_time)
+    result_queue.put({'type': 'compile', 'data': ''})
+    cases = task.get('test_case_config') or task.get('case_config') or []
+    detail = []
+    for case in cases:
+        time.sleep(random.uniform(0, 2 * case_time))
+        result_queue.put({
+            'type': 'part',
+            'test_case': case['name'],
+            'output': '',
+            'status': JudgeResult.ACCEPTED,
+        })
+        detail.append({
+            'case_name': case['name'],
+            'status': JudgeResult.ACCEPTED,
+            'statistics': {
+                'time': 0,
+                'memory': 0,
+                'exit_code': 0
+            },
+            'subcheck': case.get('subcheck'),
+        })
+    result_queue.put(
+        StubJudger.make_report(status=JudgeResult.ACCEPTED,
+                               score=sum(i['score'] for i in cases),
+                               max_time=0,
+                               max_memory=0,
+                               log='',
+                               detail=detail))
+    result_queue.put(None)
+
+
+def serve_stub(port, compile_time, case_time):
+    # Modules which need judgercore or the judge users
+    stubs = {
+        'judger': {
+            'JudgeResult': JudgeResult,
+            'Judger': StubJudger
+        },
+        'bulk': {
+            'BulkJudger': None
+        },
+        'config': {
+            'PARALLEL_USERS': 1
+        },
+    }
+    for name, attrs in stubs.items():
+        stub = types.ModuleType(name)
+        stub.__dict__.update(attrs)
+        sys.modules[name] = stub
+    import server
+    server.judge = lambda task, result_queue: stub_judge(
+        task, result_queue, compile_time, case_time)
+
+    async def main():
+        # Exit cleanly on SIGTERM so the Manager processes of server.handler
+        # are shut down instead of keeping the port open.
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
+        async with websockets.serve(server.handler, 'localhost', port):
+            await stop
+
+    asyncio.run(main())
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.is_alive():
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class LoadGenerator(object):
+
+    def __init__(self, url, trace, count, rate, concurrency, timeout,
+                 poisson=False):
+        self.url = url
+        self.trace = trace
+        self.count = count
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.poisson = poisson
+        self.records = []
+
+    async def produce(self, jobs):
+        loop = asyncio.get_running_loop()
+        arrival = loop.time()
+        for index in range(self.count):
+            task = dict(self.trace[index % len(self.trace)])
+            # Working dirs are named after task_id, so it must be unique
+            task['task_id'] = f"{task.get('task_id', 'load')}-{index}"
+            if self.rate > 0:
+                await asyncio.sleep(max(0, arrival - loop.time()))
+                scheduled = arrival
+                if self.poisson:
+                    arrival += random.expovariate(self.rate)
+                else:
+                    arrival += 1 / self.rate
+            else:
+                scheduled = loop.time()
+            # The queue is bounded, so the put may block long after the
+            # scheduled arrival
+            await jobs.put((scheduled, task))
+        for _ in range(self.concurrency):
+            await jobs.put(None)
+
+    async def consume(self, jobs):
+        websocket = None
+        while True:
+            job = await jobs.get()
+            if job is None:
+                break
+            arrival, task = job
+            # Latency counts from the scheduled arrival, so time spent
+            # waiting for a free connection is included.
+            record = {
+                'task_id': task['task_id'],
+                'status': None,
+                'queue': asyncio.get_running_loop().time() - arrival,
+            }
+            try:
+                if websocket is None:
+                    websocket = await asyncio.wait_for(
+                        websockets.connect(self.url, max_size=None),
+                        self.timeout)
+                await websocket.send(json.dumps(task))
+                await asyncio.wait_for(
+                    self.receive(websocket, arrival, record), self.timeout)
+            except (asyncio.TimeoutError, OSError,
+                    websockets.WebSocketException) as e:
+                record['error'] = repr(e)
+                if websocket is not None:
+                    await websocket.close()
+                websocket = None
+            self.records.append(record)
+        if websocket is not None:
+            await websocket.close()
+
+    @staticmethod
+    async def receive(websocket, arrival, record):
+        loop = asyncio.get_running_loop()
+        async for message in websocket:
+            item = json.loads(message)
+            elapsed = loop.time() - arrival
+            if item['type'] == 'compile':
+                record.setdefault('compile', elapsed)
+            elif item['type'] == 'part':
+                record.setdefault('first_part', elapsed)
+            elif item['type'] == 'final':
+                record['final'] = elapsed
+                record['status'] = item['status']
+                return
+        raise websockets.ConnectionClosed(None, None)
+
+    async def run(self):
+        jobs = asyncio.Queue(maxsize=self.concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(
+            self.produce(jobs),
+            *(self.consume(jobs) for _ in range(self.concurrency)))
+        return time.perf_counter() - start
+
+    def report(self, duration):
+        finished = [i for i in self.records if 'final' in i]
+        lines = [
+            f'tasks: {len(self.records)}, finished: {len(finished)}, '
+            f'errors: {len(self.records) - len(finished)}',
+            f'duration: {duration:.2f}s, '
+            f'throughput: {len(finished) / duration:.2f} tasks/s',
+            f"{'metric':<12}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}"
+            f"{'max':>10}",
+        ]
+        for metric in METRICS:
+            values = [i[metric] * 1000 for i in finished if metric in i]
+            if not values:
+                lines.append(f'{metric:<12}{0:>7}')
+                continue
+            lines.append(f'{metric:<12}{len(values):>7}' + ''.join(
+                f'{percentile(values, p):>8.1f}ms'
+                for p in (50, 95, 99, 100)))
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('trace', help='JSONL file, one task message a line')
+    parser.add_argument('--url', default='ws://localhost:8080')
+    parser.add_argument('--count', type=int, default=0,
+                        help='tasks to send, defaults to the trace length')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='arrivals per second, 0 sends as fast as the '
+                        'connections allow')
+    parser.add_argument('--poisson', action='store_true',
+                        help='exponential inter-arrival times')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='parallel websocket connections')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for the final message')
+    parser.add_argument('--output', help='write per task records as JSONL')
+    parser.add_argument('--stub', action='store_true',
+                        help='start a local server.py with a stubbed sandbox')
+    parser.add_argument('--stub-port', type=int, default=8765)
+    parser.add_argument('--stub-compile-time', type=float, default=0.3)
+    parser.add_argument('--stub-case-time', type=float, default=0.05)
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    url = args.url
+    stub_server = None
+    if args.stub:
+        url = f'ws://localhost:{args.stub_port}'
+        stub_server = Process(target=serve_stub,
+                              args=(args.stub_port, args.stub_compile_time,
+                                    args.stub_case_time))
+        stub_server.start()
+        if not wait_for_port(args.stub_port, stub_server):
+            stub_server.terminate()
+            stub_server.join()
+            raise SystemExit('Failed to start the stub server')
+    generator = LoadGenerator(url, trace, args.count or len(trace), args.rate,
+                              args.concurrency, args.timeout, args.poisson)
+    try:
+        duration = asyncio.run(generator.run())
+    finally:
+        if stub_server is not None:
+            stub_server.terminate()
+            stub_server.join()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for record in generator.records:
+                f.write(json.dumps(record) + '\n')
+    print(generator.report(duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,18 @@ import json
 
 from multiprocessing import Manager
 
+from bulk import BulkJudger
+from config import PARALLEL_USERS
 from judger import Judger, JudgeResult
 from exceptions import JudgeServiceError
 
+# Interactive tasks in progress, bulk tasks wait while the node is busy
+running = 0
+
+
+def busy():
+    return running >= PARALLEL_USERS
+
 
 def judge(task, result_queue):
     try:
@@ -16,7 +25,8 @@ def judge(task, result_queue):
                spj_id=task['spj_id'],
                test_case_config=task['test_case_config'],
                subcheck_config=task['subcheck_config'],
-               result_queue=result_queue).judge(
+               result_queue=result_queue,
+               fail_fast=task.get('fail_fast', False)).judge(
                    task['code'],
                    task['lang'],
                    task['limit'],
@@ -32,7 +42,29 @@ def judge(task, result_queue):
     result_queue.put(None)
 
 
+def judge_bulk(batch, result_queue):
+    # BulkJudger reports task errors on their task, only a malformed batch
+    # gets here.
+    try:
+        BulkJudger(tasks=batch['tasks'],
+                   result_queue=result_queue,
+                   busy=busy).judge()
+    except Exception as e:
+        if not isinstance(e, JudgeServiceError):
+            e = JudgeServiceError(repr(e))
+        result_queue.put(
+            Judger.make_report(status=JudgeResult.SYSTEM_ERROR,
+                               score=0,
+                               max_time=0,
+                               max_memory=0,
+                               log=str(e),
+                               detail=[]))
+    finally:
+        result_queue.put(None)
+
+
 async def handler(websocket):
+    global running
     async for message in websocket:
         try:
             task = json.loads(message)
@@ -41,13 +73,23 @@ async def handler(websocket):
             continue
         result_queue = Manager().Queue()
         loop = asyncio.get_event_loop()
-        judger = loop.run_in_executor(None, judge, task, result_queue)
-        while True:
-            item = await loop.run_in_executor(None, result_queue.get)
-            if item is None:
-                break
-            data = json.dumps(item)
-            await websocket.send(data)
+        bulk = task.get('type') == 'bulk'
+        if bulk:
+            judger = loop.run_in_executor(None, judge_bulk, task,
+                                          result_queue)
+        else:
+            running += 1
+            judger = loop.run_in_executor(None, judge, task, result_queue)
+        try:
+            while True:
+                item = await loop.run_in_executor(None, result_queue.get)
+                if item is None:
+                    break
+                data = json.dumps(item)
+                await websocket.send(data)
+        finally:
+            if not bulk:
+                running -= 1
 
 
 async def main():